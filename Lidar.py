@@ -1,6 +1,10 @@
+import asyncio
+import gc
 import machine
+import micropython
 import os
 import time
+from micropython import const
 
 # Attempt to import the SD Card driver
 try:
@@ -8,15 +12,38 @@ try:
 except ImportError:
     print("❌ ERROR: sdcard.py not found on Pico! Upload it via Thonny first.")
 
+DEBUG = const(False) # Print readings/timeouts to the REPL
+
 # --- PIN CONFIG ---
 PUMP_IN1, PUMP_IN2, PUMP_ENA = 15, 14, 13
 LIDAR_TX, LIDAR_RX = 8, 9
 SD_CS, SD_SCK, SD_MOSI, SD_MISO = 5, 2, 3, 4
+SD_BAUD = 20_000_000 # After the card's slow init handshake
 
 # --- CALIBRATION ---
 PUMP_THRESHOLD = 5.0
 EMPTY_CM, FULL_CM = 100.0, 20.0
 EMPTY_IN, FULL_IN = 0.0, 10.0
+_SCALE = (EMPTY_IN - FULL_IN) / (EMPTY_CM - FULL_CM) # inches per cm, computed once
+
+# --- TIMING ---
+FRAME_TIMEOUT_MS = 500
+REPORT_S = 2
+IDLE_SLEEP_MS = 1000 # lightsleep between readings while the pump is off
+
+# --- LIDAR RX BUFFER (filled by UART IRQ) ---
+FRAME_LEN = 9
+_rxbuf = bytearray(64)
+_rxlen = [0]
+_rxscratch = bytearray(32) # IRQ reads land here first (one UART FIFO's worth)
+frame_ready = False
+_frame_flag = asyncio.ThreadSafeFlag()
+
+# --- SHARED STATE ---
+pump_in1, pump_in2, pump_ena = None, None, None # Set in main(), reachable from cleanup()
+level_in, level_cm = None, None
+is_pumping = False
+level_ready = asyncio.Event()
 
 # --- HARDWARE SETUP ---
 def setup_hardware():
@@ -29,11 +56,13 @@ def setup_hardware():
 
         # LiDAR (UART1)
         uart = machine.UART(1, baudrate=115200, tx=machine.Pin(LIDAR_TX), rx=machine.Pin(LIDAR_RX))
+        # Hard IRQ so disable_irq() in get_reading really holds it off (handler must not allocate)
+        uart.irq(trigger=machine.UART.IRQ_RXIDLE, handler=_on_rx, hard=True)
 
         # SD Card (SPI0)
         spi = machine.SPI(0, baudrate=1000000, sck=machine.Pin(SD_SCK), mosi=machine.Pin(SD_MOSI), miso=machine.Pin(SD_MISO))
         cs = machine.Pin(SD_CS, machine.Pin.OUT)
-        sd = sdcard.SDCard(spi, cs)
+        sd = sdcard.SDCard(spi, cs, baudrate=SD_BAUD)
         vfs = os.VfsFat(sd)
         os.mount(vfs, "/sd")
         
@@ -42,45 +71,170 @@ def setup_hardware():
         print(f"❌ Hardware Init Failed: {e}")
         return None, None, None, None
 
-def get_reading(uart):
-    # Clear old data
-    while uart.any(): uart.read()
-    
-    # Wait for frame
-    start = time.ticks_ms()
-    while uart.any() < 9:
-        if time.ticks_diff(time.ticks_ms(), start) > 500: return None
-    
-    data = uart.read(9)
-    if data[0] == 0x59 and data[1] == 0x59:
-        if (sum(data[:8]) & 0xFF) == data[8]:
-            return data[2] + (data[3] << 8)
-    return None
-
-def main():
-    p1, p2, en, uart = setup_hardware()
-    if not p1: return # Stop if hardware fails
+@micropython.viper
+def _copy(dst: ptr8, dst_off: int, src: ptr8, src_off: int, n: int):
+    # Forward byte copy: safe when dst is below src in the same buffer
+    for k in range(n): dst[dst_off + k] = src[src_off + k]
 
-    print("🚀 System Running...")
-    
-    while True:
-        raw_cm = get_reading(uart)
-        if raw_cm:
-            # Simple Map: (x - in_min) * (out_max - out_min) / (in_max - in_min) + out_min
-            inches = (raw_cm - FULL_CM) * (EMPTY_IN - FULL_IN) / (EMPTY_CM - FULL_CM) + FULL_IN
-            inches = max(min(inches, FULL_IN), EMPTY_IN)
-            
-            # Pump Logic
-            if inches > (PUMP_THRESHOLD + 0.5):
-                p1.value(1); p2.value(0); en.duty_u16(65535)
-            elif inches < (PUMP_THRESHOLD - 0.5):
-                p1.value(0); p2.value(0); en.duty_u16(0)
-                
-            print(f"Level: {inches:.2f} in (Raw: {raw_cm} cm)")
+def _drop_front(count):
+    # Shift _rxbuf down in place, no temp buffer
+    left = _rxlen[0] - count
+    _copy(_rxbuf, 0, _rxbuf, count, left)
+    _rxlen[0] = left
+
+def _on_rx(uart):
+    # Runs in hard IRQ context: no heap allocation allowed here
+    global frame_ready
+    while uart.any():
+        n = uart.readinto(_rxscratch, min(uart.any(), len(_rxscratch))) or 0
+        over = _rxlen[0] + n - len(_rxbuf)
+        if over > 0:
+            # Overflow: drop only the oldest bytes so buffered frames survive
+            _drop_front(over)
+        _copy(_rxbuf, _rxlen[0], _rxscratch, 0, n)
+        _rxlen[0] += n
+    if _rxlen[0] >= FRAME_LEN:
+        frame_ready = True
+        _frame_flag.set()
+
+@micropython.viper
+def _parse_tfluna(buf: ptr8, off: int) -> int:
+    # Frame at buf[off:off+9] -> distance in cm, -1 bad header, -2 bad checksum
+    if buf[off] != 0x59 or buf[off + 1] != 0x59: return -1
+    s = 0
+    for i in range(8): s += buf[off + i]
+    if (s & 0xFF) != buf[off + 8]: return -2
+    return buf[off + 2] | (buf[off + 3] << 8)
+
+def get_reading():
+    global frame_ready
+    if not frame_ready: return None
+
+    # IRQs off: the hard RX handler is held off until enable_irq(), so it
+    # can't modify _rxbuf while we parse and shift
+    state = machine.disable_irq()
+
+    # Scan to the newest valid frame so a backlog never makes readings stale.
+    # A bad checksum only skips one byte, so a real frame starting inside a
+    # corrupt one is still found.
+    n = _rxlen[0]
+    i = 0
+    dist = None
+    used = 0
+    while i <= n - FRAME_LEN:
+        d = _parse_tfluna(_rxbuf, i)
+        if d >= 0:
+            dist = d
+            i += FRAME_LEN
+            used = i
         else:
-            print("⚠️ LiDAR timeout")
-            
-        time.sleep(2)
+            i += 1
+
+    # Drop everything up to the end of the newest frame (or the scanned
+    # garbage if none was found), keeping any trailing partial frame
+    _drop_front(used if dist is not None else i)
+    frame_ready = _rxlen[0] >= FRAME_LEN
+
+    machine.enable_irq(state)
+    return dist
+
+def reset_rx():
+    # Drop everything buffered (e.g. from before a lightsleep) so the next reading is a fresh frame
+    global frame_ready
+    state = machine.disable_irq()
+    _rxlen[0] = 0
+    frame_ready = False
+    machine.enable_irq(state)
+
+# --- TASKS ---
+async def loop_error(e):
+    # Report and back off; the task keeps running
+    print(f"⚠️ Loop Error: {e}")
+    await asyncio.sleep(2)
+
+async def sensor_task():
+    global level_in, level_cm
+    while True:
+        try:
+            try:
+                await asyncio.wait_for_ms(_frame_flag.wait(), FRAME_TIMEOUT_MS)
+            except asyncio.TimeoutError:
+                if DEBUG: print("⚠️ LiDAR timeout")
+                continue
+
+            raw_cm = get_reading()
+            if raw_cm:
+                # Simple Map: (x - in_min) * _SCALE + out_min, then clamp
+                inches = (raw_cm - FULL_CM) * _SCALE + FULL_IN
+                if inches < EMPTY_IN: inches = EMPTY_IN
+                if inches > FULL_IN: inches = FULL_IN
+                level_in = inches
+                level_cm = raw_cm
+                level_ready.set()
+                await asyncio.sleep_ms(0) # Let the pump/report tasks run
+
+                if not is_pumping:
+                    # Collect garbage while idle so automatic GC has less to do later.
+                    gc.collect()
+                    machine.lightsleep(IDLE_SLEEP_MS)
+                    # UART RX stopped while asleep: buffered bytes are stale or partial
+                    reset_rx()
+        except Exception as e:
+            await loop_error(e)
+
+async def control_task():
+    global is_pumping
+    while True:
+        try:
+            await level_ready.wait()
+            level_ready.clear()
+
+            # Pump Logic (pins are only touched when the state flips)
+            if not is_pumping and level_in > (PUMP_THRESHOLD + 0.5):
+                pump_in1.value(1); pump_in2.value(0); pump_ena.duty_u16(65535)
+                is_pumping = True
+            elif is_pumping and level_in < (PUMP_THRESHOLD - 0.5):
+                pump_in1.value(0); pump_in2.value(0); pump_ena.duty_u16(0)
+                is_pumping = False
+        except Exception as e:
+            await loop_error(e)
+
+async def report_task():
+    while True:
+        try:
+            await asyncio.sleep(REPORT_S)
+            if level_in is not None:
+                if DEBUG: print(f"Level: {level_in:.2f} in (Raw: {level_cm} cm)")
+        except Exception as e:
+            await loop_error(e)
+
+async def main():
+    global pump_in1, pump_in2, pump_ena
+    pump_in1, pump_in2, pump_ena, uart = setup_hardware()
+    if not pump_in1: return # Stop if hardware fails
+
+    print("🚀 System Running...")
+
+    tasks = [asyncio.create_task(sensor_task()),
+             asyncio.create_task(control_task()),
+             asyncio.create_task(report_task())]
+    await asyncio.gather(*tasks)
+
+def cleanup():
+    # Pump off first, whatever stopped the loop
+    if pump_ena:
+        pump_ena.duty_u16(0)
+        pump_in1.value(0); pump_in2.value(0)
+        print("🛑 Pump OFF")
+    try:
+        os.umount("/sd")
+    except:
+        pass
 
 if __name__ == "__main__":
-    main()
+    try:
+        asyncio.run(main())
+    except KeyboardInterrupt:
+        print("\n🛑 Stopped")
+    finally:
+        cleanup()
@@ -1,7 +1,11 @@
+import asyncio
+import gc
 import machine
+import micropython
 import os
 import time
 import sdcard 
+from micropython import const
 
 # --- 1. PIN CONFIGURATION (PICO 2 W OPTIMIZED) ---
 # Moved to GP16-18 to avoid wireless chip interference
@@ -10,7 +14,15 @@ PUMP_IN2 = 17
 PUMP_ENA = 18  
 
 # Fuel sender (ADC0)
-LEVEL_ADC_PIN = 26 
+LEVEL_ADC_PIN = const(26) 
+_ADC_CHANNEL = const(LEVEL_ADC_PIN - 26) # AINSEL: GP26..GP29 = ADC0..ADC3
+
+# RP2350 ADC registers, read directly by _avg_adc()
+_ADC_BASE = const(0x400A0000) # CS at +0, RESULT at +4
+_ADC_CS_START_ONCE = const(0x4)
+_ADC_CS_READY = const(0x100)
+_ADC_CS_AINSEL = const(0xF000)
+_ADC_POLL_LIMIT = const(10000) # A conversion takes ~2 us; this is well over that
 
 # SD Card SPI pins (Switched to SPI1 for stability on "W" models)
 SD_SPI_ID = 1    
@@ -18,16 +30,24 @@ SD_CS_PIN = 9
 SD_SPI_SCK = 10  
 SD_SPI_MOSI = 11 
 SD_SPI_MISO = 12 
+SD_BAUDRATE = 20_000_000 # Data-transfer clock once the card is initialised
 
 # --- 2. LOGIC & CALIBRATION ---
+DEBUG = const(False) # Per-sample console output; compiled out when False
 PUMP_THRESHOLD_INCHES = 5.0
+PUMP_HYSTERESIS_INCHES = 0.5 # Once pumping, keep going until the level drops this far below the threshold
 LOG_FILE_PATH = "/sd/water_log.txt"
-LOOP_DELAY_SECONDS = 5 
+LOOP_DELAY_SECONDS = 5 # Log cadence
+SAMPLE_PERIOD_MS = 100 # Sensor/pump cadence while pumping
+IDLE_SLEEP_MS = 1000 # lightsleep between samples while the pump is off
+LOG_FLUSH_BYTES = 512 # One SD sector
+LOG_FLUSH_MS = 60000
 
 ADC_EMPTY = 11000  
 ADC_FULL = 48000   
 LEVEL_EMPTY_INCHES = 0.0
 LEVEL_FULL_INCHES = 10.0 
+_SCALE = (LEVEL_FULL_INCHES - LEVEL_EMPTY_INCHES) / (ADC_FULL - ADC_EMPTY) # inches per ADC count
 
 # --- 3. GLOBAL OBJECTS ---
 pump_in1 = None
@@ -36,6 +56,20 @@ pump_ena = None
 adc = None
 sd = None
 
+# Latest reading, shared between tasks
+level = None
+status = "IDLE"
+level_ready = asyncio.Event()
+_last_state = None # Pump state last written to the pins
+
+# Log lines waiting to be written to the SD card
+_logbuf = bytearray()
+_last_flush = time.ticks_ms()
+
+# Timestamp bytes for the current second (reused by every line in it)
+_ts_sec = -1
+_ts_buf = b""
+
 # --- 4. HELPER FUNCTIONS ---
 
 def setup():
@@ -86,8 +120,8 @@ def setup():
                           mosi=machine.Pin(SD_SPI_MOSI),
                           miso=machine.Pin(SD_SPI_MISO))
         
-        # Step D: Mount
-        sd = sdcard.SDCard(spi, cs)
+        # Step D: Mount (driver handshakes slowly, then switches to SD_BAUDRATE)
+        sd = sdcard.SDCard(spi, cs, baudrate=SD_BAUDRATE)
         os.mount(sd, "/sd")
         print("✅ SD Card mounted successfully at /sd")
         
@@ -100,72 +134,157 @@ def setup():
         print("Check: Is sdcard.py on the Pico? Is card FAT32?")
         return False
 
-def map_value(x, in_min, in_max, out_min, out_max):
-    return (x - in_min) * (out_max - out_min) / (in_max - in_min) + out_min
+@micropython.viper
+def _avg_adc() -> int:
+    # Trigger conversions and read RESULT straight from the ADC registers.
+    # machine.ADC (created in setup) has already enabled the ADC and the pin.
+    # Returns -1 if a conversion never completes (ADC disabled or unclocked).
+    regs = ptr32(_ADC_BASE)
+    cs = (regs[0] & ~_ADC_CS_AINSEL) | (_ADC_CHANNEL << 12)
+    s = 0
+    for _ in range(5):
+        regs[0] = cs | _ADC_CS_START_ONCE
+        polls = 0
+        while not (regs[0] & _ADC_CS_READY):
+            polls += 1
+            if polls > _ADC_POLL_LIMIT:
+                return -1
+        r = regs[1]
+        s += (r << 4) | (r >> 8) # 12-bit -> 16-bit, same scaling as read_u16()
+    return s // 5
 
+@micropython.native
 def read_water_level():
     try:
         # Take 5 readings and average them to filter wireless noise
-        readings = [adc.read_u16() for _ in range(5)]
-        avg_adc = sum(readings) / len(readings)
+        avg_adc = _avg_adc()
+        if avg_adc < 0:
+            return None # ADC not responding
         
-        inches = map_value(avg_adc, ADC_EMPTY, ADC_FULL, LEVEL_EMPTY_INCHES, LEVEL_FULL_INCHES)
+        inches = (avg_adc - ADC_EMPTY) * _SCALE + LEVEL_EMPTY_INCHES
         # Clamp values between min/max
-        return max(min(inches, LEVEL_FULL_INCHES), LEVEL_EMPTY_INCHES)
+        if inches < LEVEL_EMPTY_INCHES: return LEVEL_EMPTY_INCHES
+        if inches > LEVEL_FULL_INCHES: return LEVEL_FULL_INCHES
+        return inches
     except:
         return None
 
 def log_to_sd(message):
+    global _ts_sec, _ts_buf
+    now = time.time()
+    if now != _ts_sec:
+        t = time.localtime(now)
+        _ts_buf = b"%04d-%02d-%02d %02d:%02d:%02d" % (t[0], t[1], t[2], t[3], t[4], t[5])
+        _ts_sec = now
+    _logbuf.extend(_ts_buf)
+    _logbuf.extend(b", ")
+    _logbuf.extend(message.encode())
+    _logbuf.extend(b"\n")
+
+def flush_log(force=False):
+    """Append buffered log lines to the SD card once a sector or a minute has built up."""
+    global _logbuf, _last_flush
+    now = time.ticks_ms()
+    if not force and len(_logbuf) < LOG_FLUSH_BYTES and time.ticks_diff(now, _last_flush) <= LOG_FLUSH_MS:
+        return
     try:
-        t = time.localtime()
-        timestamp = "{:04d}-{:02d}-{:02d} {:02d}:{:02d}:{:02d}".format(*t[0:6])
-        with open(LOG_FILE_PATH, "a") as f:
-            f.write(f"{timestamp}, {message}\n")
+        if _logbuf:
+            with open(LOG_FILE_PATH, "ab") as f:
+                f.write(_logbuf)
     except Exception as e:
         print(f"Logging error: {e}")
+    _logbuf = bytearray()
+    _last_flush = now
 
 def control_pump(current_level):
-    if current_level > PUMP_THRESHOLD_INCHES:
+    global _last_state
+    if _last_state == "PUMPING":
+        pumping = current_level > PUMP_THRESHOLD_INCHES - PUMP_HYSTERESIS_INCHES
+    else:
+        pumping = current_level > PUMP_THRESHOLD_INCHES
+    new_state = "PUMPING" if pumping else "IDLE"
+    if new_state == _last_state:
+        return new_state # No change: leave the pins and PWM slice alone
+    _last_state = new_state
+
+    if new_state == "PUMPING":
         pump_in1.value(1)
         pump_in2.value(0)
         pump_ena.duty_u16(65535) # Full Speed
-        return "PUMPING"
     else:
         pump_ena.duty_u16(0)
         pump_in1.value(0)
         pump_in2.value(0)
-        return "IDLE"
+    return new_state
         
-# --- 5. MAIN LOOP ---
-def main():
-    if not setup():
-        print("Aborting: Hardware setup failed.")
-        return 
+# --- 5. TASKS ---
+async def loop_error(e):
+    """Report a task error and back off; the task then carries on."""
+    print(f"Loop Error: {e}")
+    await asyncio.sleep(2)
 
-    print("\nStarting Monitoring Loop... (Press Ctrl+C to stop)")
-    
+async def sensor_task():
+    """Sample the fuel sender and wake the pump controller."""
+    global level
     while True:
         try:
-            level = read_water_level()
-            
+            reading = read_water_level()
+            if reading is not None:
+                level = reading
+                level_ready.set()
+            await asyncio.sleep_ms(0) # Let the pump and log tasks run first
+
+            if status == "IDLE":
+                # Nothing to drive: collect garbage, then low-power sleep until the next sample
+                gc.collect()
+                machine.lightsleep(IDLE_SLEEP_MS)
+            else:
+                await asyncio.sleep_ms(SAMPLE_PERIOD_MS)
+        except Exception as e:
+            await loop_error(e)
+
+async def control_task():
+    """Drive the pump as soon as a new level arrives."""
+    global status
+    while True:
+        try:
+            await level_ready.wait()
+            level_ready.clear()
+            status = control_pump(level)
+        except Exception as e:
+            await loop_error(e)
+
+async def log_task():
+    """Print and log the latest level on its own cadence."""
+    while True:
+        try:
+            await asyncio.sleep(LOOP_DELAY_SECONDS)
             if level is not None:
-                status = control_pump(level)
                 output = f"Level: {level:.2f} in , Status: {status}"
-                print(output)
+                if DEBUG: print(output)
                 log_to_sd(output)
-                
-            time.sleep(LOOP_DELAY_SECONDS)
-            
-        except KeyboardInterrupt:
-            print("\nStopping system...")
-            break
+            flush_log()
         except Exception as e:
-            print(f"Loop Error: {e}")
-            time.sleep(2) 
+            await loop_error(e)
 
-    # --- Cleanup ---
+# --- 6. MAIN ---
+async def main():
+    if not setup():
+        print("Aborting: Hardware setup failed.")
+        return 
+
+    print("\nStarting Monitoring Loop... (Press Ctrl+C to stop)")
+    
+    tasks = [asyncio.create_task(sensor_task()),
+             asyncio.create_task(control_task()),
+             asyncio.create_task(log_task())]
+    await asyncio.gather(*tasks)
+
+def cleanup():
     if pump_ena:
         pump_ena.duty_u16(0)
+    if sd:
+        flush_log(force=True)
     try:
         os.umount("/sd")
         print("SD Card unmounted.")
@@ -174,4 +293,9 @@ def main():
     print("Cleanup complete. Goodbye.")
 
 if __name__ == "__main__":
-    main()
+    try:
+        asyncio.run(main())
+    except KeyboardInterrupt:
+        print("\nStopping system...")
+    finally:
+        cleanup()
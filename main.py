@@ -1,7 +1,11 @@
+import asyncio
+import gc
 import machine
+import micropython
 import os
 import time
 import sdcard # Ensure this file is on your Pico
+from micropython import const
 
 # --- 1. PIN CONFIGURATION (PICO-SPECIFIC PINS) ---
 # L298N Motor Driver Pins
@@ -18,17 +22,26 @@ SD_CS_PIN = 5    # Chip Select (CS) can be any GPIO
 SD_SPI_SCK = 2   # Serial Clock (SCK)
 SD_SPI_MOSI = 3  # Master Out Slave In (MOSI)
 SD_SPI_MISO = 4  # Master In Slave Out (MISO)
+SD_BAUDRATE = 20_000_000 # SPI clock after card init (init itself runs slow)
 
 # --- 2. LOGIC & CALIBRATION (FILL THESE IN!) ---
+DEBUG = const(False) # Set True to print every reading over USB serial
 PUMP_THRESHOLD_INCHES = 5.0
+PUMP_HYSTERESIS_INCHES = 0.5 # Once pumping, keep going until the level drops this far below the threshold
 LOG_FILE_PATH = "/sd/water_log.txt"
-LOOP_DELAY_SECONDS = 5 
+LOOP_DELAY_SECONDS = 5 # How often the level is logged
+SAMPLE_PERIOD_MS = 100 # How often the pump reacts to a new reading
+IDLE_SLEEP_MS = 1000 # Low-power sleep between readings while the pump is off
+LOG_FLUSH_BYTES = 512 # Flush once a full SD sector is buffered...
+LOG_FLUSH_MS = 60000 # ...or at least once a minute
 
 # Calibrated ADC values (Must be determined experimentally!)
 ADC_EMPTY = 11000  
 ADC_FULL = 48000   
 LEVEL_EMPTY_INCHES = 0.0
 LEVEL_FULL_INCHES = 10.0 
+# Inches per ADC count, computed once from the calibration above
+_SCALE = (LEVEL_FULL_INCHES - LEVEL_EMPTY_INCHES) / (ADC_FULL - ADC_EMPTY)
 
 # --- 3. GLOBAL OBJECTS ---
 pump_in1 = None
@@ -37,6 +50,20 @@ pump_ena = None
 adc = None
 sd = None
 
+# Latest reading, shared between the tasks below
+level_inches = None
+pump_status = "STOPPED"
+level_ready = asyncio.Event()
+_last_state = None # Last state written to the L298N, None until first reading
+
+# Log lines buffered in RAM until the next flush
+_logbuf = bytearray()
+_last_flush = time.ticks_ms()
+
+# Formatted timestamp, cached until the clock moves to the next second
+_ts_sec = -1
+_ts_buf = b""
+
 # --- 4. HELPER FUNCTIONS ---
 
 def setup():
@@ -77,7 +104,7 @@ def setup():
                           miso=machine.Pin(SD_SPI_MISO))
         
         cs = machine.Pin(SD_CS_PIN, machine.Pin.OUT)
-        sd = sdcard.SDCard(spi, cs)
+        sd = sdcard.SDCard(spi, cs, baudrate=SD_BAUDRATE)
         
         os.mount(sd, "/sd")
         print("✅ SD Card mounted successfully at /sd")
@@ -91,82 +118,147 @@ def setup():
         print(f"❌ Failed to initialize SD card: {e}")
         return False
 
-# --- Mapping and Logging functions (Unchanged from previous full script) ---
-
-def map_value(x, in_min, in_max, out_min, out_max):
-    return (x - in_min) * (out_max - out_min) / (in_max - in_min) + out_min
+# --- Level reading and buffered SD logging ---
 
+@micropython.native
 def read_water_level():
     try:
         raw_adc = adc.read_u16() 
-        inches = map_value(raw_adc, ADC_EMPTY, ADC_FULL, LEVEL_EMPTY_INCHES, LEVEL_FULL_INCHES)
-        if inches < LEVEL_EMPTY_INCHES: inches = LEVEL_EMPTY_INCHES
-        if inches > LEVEL_FULL_INCHES: inches = LEVEL_FULL_INCHES
+        inches = (raw_adc - ADC_EMPTY) * _SCALE + LEVEL_EMPTY_INCHES
+        if inches < LEVEL_EMPTY_INCHES: return LEVEL_EMPTY_INCHES
+        if inches > LEVEL_FULL_INCHES: return LEVEL_FULL_INCHES
         return inches
     except:
         return None
 
 def log_to_sd(message):
-    """Appends a timestamped message to the log file."""
+    """Buffers a timestamped message for the log file."""
+    global _ts_sec, _ts_buf
+    now = time.time()
+    if now != _ts_sec:
+        t = time.localtime(now)
+        _ts_buf = b"%04d-%02d-%02d %02d:%02d:%02d" % (t[0], t[1], t[2], t[3], t[4], t[5])
+        _ts_sec = now
+    _logbuf.extend(_ts_buf)
+    _logbuf.extend(b", ")
+    _logbuf.extend(message.encode())
+    _logbuf.extend(b"\n")
+
+def flush_log(force=False):
+    """Appends the buffered messages to the log file in a single write."""
+    global _logbuf, _last_flush
+    now = time.ticks_ms()
+    if not force and len(_logbuf) < LOG_FLUSH_BYTES and time.ticks_diff(now, _last_flush) <= LOG_FLUSH_MS:
+        return
     try:
-        t = time.localtime()
-        timestamp = "{:04d}-{:02d}-{:02d} {:02d}:{:02d}:{:02d}".format(
-            t[0], t[1], t[2], t[3], t[4], t[5])
-        log_entry = f"{timestamp}, {message}\n"
-        with open(LOG_FILE_PATH, "a") as f:
-            f.write(log_entry)
+        if _logbuf:
+            with open(LOG_FILE_PATH, "ab") as f:
+                f.write(_logbuf)
     except Exception as e:
         print(f"Error writing to SD card: {e}")
+    _logbuf = bytearray()
+    _last_flush = now
 
 
 def control_pump(current_level):
-    if current_level > PUMP_THRESHOLD_INCHES:
+    """Drives the pump pins, but only when the pump state changes."""
+    global _last_state
+    if _last_state == "PUMPING":
+        pumping = current_level > PUMP_THRESHOLD_INCHES - PUMP_HYSTERESIS_INCHES
+    else:
+        pumping = current_level > PUMP_THRESHOLD_INCHES
+    new_state = "PUMPING" if pumping else "STOPPED"
+    if new_state == _last_state:
+        return new_state
+    _last_state = new_state
+
+    if new_state == "PUMPING":
         # Turn ON
         pump_in1.value(1)
         pump_in2.value(0)
         pump_ena.duty_u16(65535)
-        print("Status: PUMPING")
     else:
         # FORCE OFF - If level is 0, this WILL execute
         pump_ena.duty_u16(0)
         pump_in1.value(0)
         pump_in2.value(0)
-        print("Status: STOPPED")
+    return new_state
         
-# --- 5. MAIN LOOP ---
-def main():
-    if not setup():
-        print("System Halted.")
-        return 
+# --- 5. TASKS ---
+async def loop_error(e):
+    """Reports a task error and backs off, so the task keeps running."""
+    print(f"\nMain loop error: {e}")
+    log_to_sd(f"FATAL ERROR: {e}")
+    await asyncio.sleep(5)
 
-    print("\nStarting monitoring loop...")
-    
+async def sensor_task():
+    """Reads the fuel sender and signals the pump task."""
+    global level_inches
     while True:
         try:
-            level_inches = read_water_level()
-            
+            reading = read_water_level()
+            if reading is not None:
+                level_inches = reading
+                level_ready.set()
+            await asyncio.sleep_ms(0) # Give the pump and log tasks a turn
+
+            if pump_status == "STOPPED":
+                # lightsleep keeps RAM and pin states; PWM is already at 0.
+                # Run the GC here so it doesn't kick in during a reading.
+                gc.collect()
+                machine.lightsleep(IDLE_SLEEP_MS)
+            else:
+                await asyncio.sleep_ms(SAMPLE_PERIOD_MS)
+        except Exception as e:
+            await loop_error(e)
+
+async def control_task():
+    """Updates the pump every time a new reading is available."""
+    global pump_status
+    while True:
+        try:
+            await level_ready.wait()
+            level_ready.clear()
+            pump_status = control_pump(level_inches)
+        except Exception as e:
+            await loop_error(e)
+
+async def log_task():
+    """Prints and logs the latest reading every LOOP_DELAY_SECONDS."""
+    while True:
+        try:
+            await asyncio.sleep(LOOP_DELAY_SECONDS)
             if level_inches is not None:
-                print(f"[{time.time()}] Current Level: {level_inches:.2f} inches")
+                if DEBUG:
+                    print(f"[{time.time()}] Current Level: {level_inches:.2f} inches")
+                    print(f"Status: {pump_status}")
                 log_to_sd(f"Level: {level_inches:.2f} in")
-                control_pump(level_inches)
-                
-            time.sleep(LOOP_DELAY_SECONDS)
-            
-        except KeyboardInterrupt:
-            print("\nLoop stopped by user.")
-            break
+            flush_log()
         except Exception as e:
-            print(f"\nMain loop error: {e}")
-            log_to_sd(f"FATAL ERROR: {e}")
-            time.sleep(5) 
+            await loop_error(e)
+
+# --- 6. MAIN ---
+async def main():
+    if not setup():
+        print("System Halted.")
+        return 
 
-    # --- Cleanup ---
+    print("\nStarting monitoring loop...")
+    
+    tasks = [asyncio.create_task(sensor_task()),
+             asyncio.create_task(control_task()),
+             asyncio.create_task(log_task())]
+    await asyncio.gather(*tasks)
+
+def cleanup():
+    """Turns the pump off and unmounts the SD card."""
     if pump_ena:
         pump_ena.duty_u16(0)
         pump_in1.value(0)
         pump_in2.value(0)
         print("Pump is safely turned OFF.")
     if sd:
+        flush_log(force=True)
         try:
             os.umount("/sd")
             print("SD Card unmounted.")
@@ -174,4 +266,9 @@ def main():
             print("Could not unmount SD card.")
 
 if __name__ == "__main__":
-    main()
+    try:
+        asyncio.run(main())
+    except KeyboardInterrupt:
+        print("\nLoop stopped by user.")
+    finally:
+        cleanup()
@@ -0,0 +1,5 @@
+# Custom firmware manifest: freezes the SD card driver into flash (see README).
+# The scripts don't use WiFi; include "$(BOARD_DIR)/manifest.py" instead on W boards to keep it.
+include("$(PORT_DIR)/boards/manifest.py")
+
+require("sdcard", opt=3)